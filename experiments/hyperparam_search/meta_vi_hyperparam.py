@@ -1,5 +1,4 @@
 import ray
-import copy
 import torch
 import numpy as np
 import pandas as pd
@@ -10,6 +9,7 @@ import math
 from ray import tune
 
 from ray.tune.suggest.hyperopt import HyperOptSearch
+from ray.tune.schedulers import AsyncHyperBandScheduler
 from ray.tune import Analysis
 from hyperopt import hp
 from datetime import datetime
@@ -21,8 +21,20 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 DATA_DIR = os.path.join(BASE_DIR, "data")
 HPARAM_EXP_DIR = os.path.join(DATA_DIR, "tune-hparam-ntasks")
 
+# add project dir to path (of the driver and, via PYTHONPATH, of the ray workers)
+sys.path.append(BASE_DIR)
+os.environ["PYTHONPATH"] = os.pathsep.join(
+    filter(None, [BASE_DIR, os.environ.get("PYTHONPATH")])
+)
+
+from experiments.data_sim import provide_data
+from meta_learn.GPR_meta_vi import GPRegressionMetaLearnedVI
+from meta_learn.config import device
+
 SEED = 28
 N_THREADS_PER_RUN = 1
+EVAL_PERIOD = 3000
+N_GPUS_PER_RUN = 0.25
 TEST_SEEDS = [28, 29, 30, 31, 32]
 
 # configuration for prior learning
@@ -35,60 +47,66 @@ def main(args):
         object_store_memory=300 * 1024**2,
     )
 
-    def train_reg(config, reporter):
-        sys.path.append(BASE_DIR)
+    # load / generate data once and share it with all runs via the object store
+    data_train, data_valid, data_test = provide_data(dataset=args.dataset, seed=SEED)
+    data_train_ref = ray.put(data_train)
+    data_valid_ref = ray.put(data_valid)
+    data_test_ref = ray.put(data_test)
 
-        # 1) load / generate data
-        from experiments.data_sim import provide_data
+    class TrainReg(tune.Trainable):
+        """Meta-trains the model in chunks of EVAL_PERIOD steps, reports valid metrics after each."""
 
-        data_train, data_valid, _ = provide_data(dataset=args.dataset, seed=SEED)
+        def setup(self, config):
+            # 1) fetch data from object store
+            self.data_train = ray.get(data_train_ref)
+            self.data_valid = ray.get(data_valid_ref)
 
-        # 2) setup model
-        from meta_learn.GPR_meta_vi import GPRegressionMetaLearnedVI
+            if device.type == "cpu":
+                torch.set_num_threads(N_THREADS_PER_RUN)
 
-        torch.set_num_threads(N_THREADS_PER_RUN)
+            # 2) setup model
+            self._setup_model(config)
 
-        model = GPRegressionMetaLearnedVI(data_train, **config)
-
-        # 3) train and evaluate model
-        with gpytorch.settings.max_cg_iterations(300):
-            eval_period = 3000
-            train_iter = 0
-            for i in range(config["num_iter_fit"] // eval_period):
-                loss = model.meta_fit(
-                    verbose=False, log_period=2000, n_iter=eval_period
-                )
-                train_iter += eval_period
-                ll, rmse, calib_err = model.eval_datasets(data_valid)
-                reporter(
-                    timesteps_total=train_iter,
-                    loss=loss,
-                    test_rmse=rmse,
-                    test_ll=ll,
-                    calib_err=calib_err,
+        def step(self):
+            # 3) train and evaluate model
+            with gpytorch.settings.max_cg_iterations(300):
+                loss = self.model.meta_fit(
+                    verbose=False, log_period=2000, n_iter=EVAL_PERIOD
                 )
-
-    @ray.remote
-    def train_test(config):
+                self.train_iter += EVAL_PERIOD
+                ll, rmse, calib_err = self.model.eval_datasets(self.data_valid)
+            return dict(
+                timesteps_total=self.train_iter,
+                loss=loss,
+                test_rmse=rmse,
+                test_ll=ll,
+                calib_err=calib_err,
+                done=self.train_iter + EVAL_PERIOD > self.num_iter_fit,
+            )
+
+        def reset_config(self, new_config):
+            # re-use the actor (and its data) for the next trial
+            self._setup_model(new_config)
+            return True
+
+        def _setup_model(self, config):
+            self.model = GPRegressionMetaLearnedVI(self.data_train, **config)
+            self.num_iter_fit = config["num_iter_fit"]
+            self.train_iter = 0
+
+    @ray.remote(num_gpus=N_GPUS_PER_RUN if device.type == "cuda" else 0)
+    def train_test(config, data_train, data_test):
         results_dict = config
 
         try:
-            sys.path.append(BASE_DIR)
-
-            # 1) load / generate data
-            from experiments.data_sim import provide_data
-
-            data_train, _, data_test = provide_data(dataset=args.dataset, seed=SEED)
-
-            # 2) Fit model
-            from meta_learn.GPR_meta_vi import GPRegressionMetaLearnedVI
-
-            torch.set_num_threads(N_THREADS_PER_RUN)
+            # 1) Fit model (data is resolved from the object store by ray)
+            if device.type == "cpu":
+                torch.set_num_threads(N_THREADS_PER_RUN)
             with gpytorch.settings.max_cg_iterations(500):
                 model = GPRegressionMetaLearnedVI(data_train, **config)
                 model.meta_fit(data_test, log_period=5000)
 
-                # 3) evaluate on test set
+                # 2) evaluate on test set
                 ll, rmse, calib_err = model.eval_datasets(data_test)
 
             results_dict.update(ll=ll, rmse=rmse, calib_err=calib_err)
@@ -137,6 +155,10 @@ def main(args):
                 "cov_type": "diag",
             },
             "stop": {"timesteps_total": 30000},
+            "resources_per_trial": {
+                "cpu": 1,
+                "gpu": N_GPUS_PER_RUN if device.type == "cuda" else 0,
+            },
         }
 
         # Run hyper-parameter search
@@ -148,10 +170,22 @@ def main(args):
             mode="max" if args.metric == "test_ll" else "min",
         )
 
+        # early-stop unpromising trials based on the intermediate evaluations
+        scheduler = AsyncHyperBandScheduler(
+            time_attr="timesteps_total",
+            metric=args.metric,
+            mode="max" if args.metric == "test_ll" else "min",
+            max_t=config["config"]["num_iter_fit"],
+            grace_period=EVAL_PERIOD,
+            reduction_factor=3,
+        )
+
         analysis = tune.run(
-            train_reg,
+            TrainReg,
             name=exp_name,
             search_alg=algo,
+            scheduler=scheduler,
+            reuse_actors=True,
             verbose=1,
             raise_on_failed_trial=False,
             local_dir=HPARAM_EXP_DIR,
@@ -176,11 +210,18 @@ def main(args):
     test_configs = []
     for config in best_configs:
         for seed in TEST_SEEDS:
-            test_config = copy.deepcopy(config)
-            test_config.update({"random_seed": seed})
-            test_configs.append(test_config)
-
-    result_dicts = ray.get([train_test.remote(config) for config in test_configs])
+            # config values are only read -> a shallow copy suffices
+            test_configs.append({**config, "random_seed": seed})
+
+    # keep at most num_cpus test runs in flight and collect results as they finish
+    result_dicts = []
+    inflight = []
+    for config in test_configs:
+        if len(inflight) >= args.num_cpus:
+            done, inflight = ray.wait(inflight, num_returns=1)
+            result_dicts.extend(ray.get(done))
+        inflight.append(train_test.remote(config, data_train_ref, data_test_ref))
+    result_dicts.extend(ray.get(inflight))
 
     result_df = pd.DataFrame(result_dicts)
     print(result_df.to_string())
@@ -430,10 +430,8 @@ class GPRegressionMetaLearnedPAC(RegressionModelMetaLearned):
 
         def _tile_data_tuple(task_dict, tile_size):
             x_data, y_data = task_dict["train_x"], task_dict["train_y"]
-            x_data = x_data.view(torch.Size((1,)) + x_data.shape).repeat(
-                tile_size, 1, 1
-            )
-            y_data = y_data.view(torch.Size((1,)) + y_data.shape).repeat(tile_size, 1)
+            x_data = x_data.unsqueeze(0).expand(tile_size, *x_data.shape)
+            y_data = y_data.unsqueeze(0).expand(tile_size, *y_data.shape)
             return x_data, y_data
 
         def _hyper_kl(prior_param_sample):
@@ -576,7 +574,7 @@ class GPRegressionMetaLearnedPAC(RegressionModelMetaLearned):
 
         def _tile(x_data):
             assert x_data.ndim == 2
-            return x_data.view(torch.Size((1,)) + x_data.shape).repeat(n_samples, 1, 1)
+            return x_data.unsqueeze(0).expand(n_samples, *x_data.shape)
 
         def mean_module(x):
             gp, _ = forward_fn(_tile(x), None, prior=True)
@@ -255,12 +255,8 @@ class GPRegressionMetaLearnedSVGD(RegressionModelMetaLearned):
             train_data_tuples_tiled = []
             for task_dict in tasks_dicts:
                 x_data, y_data = task_dict["train_x"], task_dict["train_y"]
-                x_data = x_data.view(torch.Size((1,)) + x_data.shape).repeat(
-                    self.num_particles, 1, 1
-                )
-                y_data = y_data.view(torch.Size((1,)) + y_data.shape).repeat(
-                    self.num_particles, 1
-                )
+                x_data = x_data.unsqueeze(0).expand(self.num_particles, *x_data.shape)
+                y_data = y_data.unsqueeze(0).expand(self.num_particles, *y_data.shape)
                 train_data_tuples_tiled.append((x_data, y_data))
 
             self.svgd.step(self.particles, train_data_tuples_tiled)
@@ -268,15 +264,15 @@ class GPRegressionMetaLearnedSVGD(RegressionModelMetaLearned):
         """ define predictive dist """
 
         def get_pred_dist(x_context, y_context, x_valid):
-            with torch.no_grad():
-                x_context = x_context.view(torch.Size((1,)) + x_context.shape).repeat(
-                    self.num_particles, 1, 1
+            with torch.inference_mode():
+                x_context = x_context.unsqueeze(0).expand(
+                    self.num_particles, *x_context.shape
                 )
-                y_context = y_context.view(torch.Size((1,)) + y_context.shape).repeat(
-                    self.num_particles, 1
+                y_context = y_context.unsqueeze(0).expand(
+                    self.num_particles, *y_context.shape
                 )
-                x_valid = x_valid.view(torch.Size((1,)) + x_valid.shape).repeat(
-                    self.num_particles, 1, 1
+                x_valid = x_valid.unsqueeze(0).expand(
+                    self.num_particles, *x_valid.shape
                 )
 
                 gp_fn = self.random_gp.get_forward_fn(self.particles)
@@ -33,6 +33,7 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
         task_batch_size=-1,
         normalize_data=True,
         random_seed=None,
+        elbo_precision="fp32",
     ):
         """
         PACOH-VI: Variational Inference on the PAC-optimal hyper-posterior with Gaussian family.
@@ -58,6 +59,10 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
             task_batch_size: (int) mini-batch size of tasks for estimating gradients
             normalize_data: (bool) whether the data should be normalized
             random_seed: (int) seed for pytorch
+            elbo_precision: (str) precision of the ELBO computation - either 'fp32' or 'bf16'. With 'bf16' the
+                            NN matmuls run under bfloat16 autocast while the posterior sample and log-density,
+                            kernel matrices and their Cholesky decomposition stay in fp32. Less accurate
+                            gradients, use 'fp32' if training is unstable
         """
         super().__init__(normalize_data, random_seed)
 
@@ -68,6 +73,7 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
             covar_module, gpytorch.kernels.Kernel
         )
         assert optimizer in ["Adam", "SGD"]
+        assert elbo_precision in ["fp32", "bf16"]
 
         self.num_iter_fit, self.prior_factor, self.feature_dim = (
             num_iter_fit,
@@ -76,6 +82,7 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
         )
         self.weight_prior_std, self.bias_prior_std = weight_prior_std, bias_prior_std
         self.svi_batch_size = svi_batch_size
+        self.elbo_precision = elbo_precision
         if task_batch_size < 1:
             self.task_batch_size = len(meta_train_data)
         else:
@@ -101,6 +108,14 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
             # a) prepare data
             x_tensor, y_tensor = self._prepare_data_per_task(train_x, train_y)
             task_dict["train_x"], task_dict["train_y"] = x_tensor, y_tensor
+
+            # b) tile data to svi_batch_shape once (stride-0 views, no copy)
+            task_dict["train_x_tiled"] = x_tensor.unsqueeze(0).expand(
+                self.svi_batch_size, *x_tensor.shape
+            )
+            task_dict["train_y_tiled"] = y_tensor.unsqueeze(0).expand(
+                self.svi_batch_size, *y_tensor.shape
+            )
             self.task_dicts.append(task_dict)
 
         self.fitted = False
@@ -125,10 +140,14 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
         if n_iter is None:
             n_iter = self.num_iter_fit
 
+        n_tasks = len(self.task_dicts)
+
         for itr in range(1, n_iter + 1):
-            task_dict_batch = self.rds_numpy.choice(
-                self.task_dicts, size=self.task_batch_size
-            )
+            if self.task_batch_size == n_tasks:
+                task_dict_batch = self.task_dicts
+            else:
+                task_idx = self.rds_numpy.randint(0, n_tasks, size=self.task_batch_size)
+                task_dict_batch = [self.task_dicts[i] for i in task_idx]
             self.optimizer.zero_grad()
             loss = self.get_neg_elbo(task_dict_batch)
             loss.backward()
@@ -137,19 +156,24 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
 
             # print training stats stats
             if itr == 1 or itr % log_period == 0:
+                # .item() syncs with the device -> read the loss before stopping the clock
+                loss_value = loss.item()
                 duration = time.time() - t
                 t = time.time()
 
                 message = "Iter %d/%d - Loss: %.6f - Time %.2f sec" % (
                     itr,
-                    self.num_iter_fit,
-                    loss.item(),
+                    n_iter,
+                    loss_value,
                     duration,
                 )
 
                 # if validation data is provided  -> compute the valid log-likelihood
                 if valid_tuples is not None:
-                    valid_ll, valid_rmse, calibr_err = self.eval_datasets(valid_tuples)
+                    with torch.inference_mode():
+                        valid_ll, valid_rmse, calibr_err = self.eval_datasets(
+                            valid_tuples
+                        )
                     message += (
                         " - Valid-LL: %.3f - Valid-RMSE: %.3f - Calib-Err %.3f"
                         % (valid_ll, valid_rmse, calibr_err)
@@ -196,11 +220,26 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
         test_x = self._normalize_data(X=test_x, Y=None)
         test_x = torch.from_numpy(test_x).float().to(device)
 
-        with torch.no_grad():
+        with torch.inference_mode():
             if mode == "Bayes" or mode == "bayes":
                 pred_dist = self.get_pred_dist(
                     context_x, context_y, test_x, n_post_samples=n_posterior_samples
                 )
+                if not return_density:
+                    # only mean and std required -> compute the mixture moments directly
+                    y_mean = torch.tensor(
+                        self.y_mean, dtype=torch.float32, device=device
+                    )
+                    y_std = torch.tensor(self.y_std, dtype=torch.float32, device=device)
+                    means = pred_dist.mean * y_std + y_mean
+                    variances = pred_dist.variance * y_std**2
+                    pred_mean = torch.mean(means, dim=0)
+                    pred_std = torch.sqrt(
+                        torch.mean(variances, dim=0)
+                        + torch.var(means, dim=0, unbiased=False)
+                    )
+                    return pred_mean.cpu().numpy(), pred_std.cpu().numpy()
+
                 pred_dist = AffineTransformedDistribution(
                     pred_dist,
                     normalization_mean=self.y_mean,
@@ -223,18 +262,15 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
                 return pred_mean, pred_std
 
     def state_dict(self):
+        # all tasks share the variational hyper-posterior -> no per-task state
         state_dict = {
             "optimizer": self.optimizer.state_dict(),
-            "model": self.task_dicts[0]["model"].state_dict(),
+            "model": self.posterior.state_dict(),
         }
-        for task_dict in self.task_dicts:
-            for key, tensor in task_dict["model"].state_dict().items():
-                assert torch.all(state_dict["model"][key] == tensor).item()
         return state_dict
 
     def load_state_dict(self, state_dict):
-        for task_dict in self.task_dicts:
-            task_dict["model"].load_state_dict(state_dict["model"])
+        self.posterior.load_state_dict(state_dict["model"])
         self.optimizer.load_state_dict(state_dict["optimizer"])
 
     def _setup_model_inference(
@@ -265,48 +301,54 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
         """ variational posterior """
         self.posterior = RandomGPPosterior(param_shapes_dict, cov_type=cov_type)
 
-        def _tile_data_tuples(tasks_dicts, tile_size):
-            train_data_tuples_tiled = []
-            for task_dict in tasks_dicts:
-                x_data, y_data = task_dict["train_x"], task_dict["train_y"]
-                x_data = x_data.view(torch.Size((1,)) + x_data.shape).repeat(
-                    tile_size, 1, 1
-                )
-                y_data = y_data.view(torch.Size((1,)) + y_data.shape).repeat(
-                    tile_size, 1
-                )
-                train_data_tuples_tiled.append((x_data, y_data))
-            return train_data_tuples_tiled
+        # noise buffer of the reparameterized posterior samples, re-filled every step
+        self._noise_buf = torch.empty(
+            (self.svi_batch_size,) + self.posterior.loc.shape, device=device
+        )
 
         """ define negative ELBO """
 
-        def get_neg_elbo(tasks_dicts):
-            # tile data to svi_batch_shape
-            data_tuples_tiled = _tile_data_tuples(tasks_dicts, self.svi_batch_size)
-
-            param_sample = self.posterior.rsample(sample_shape=(self.svi_batch_size,))
-            elbo = self.random_gp.log_prob(
-                param_sample, data_tuples_tiled
-            ) - self.prior_factor * self.posterior.log_prob(param_sample)
+        self._elbo_shape_checked = False
 
-            assert elbo.ndim == 1 and elbo.shape[0] == self.svi_batch_size
-            return -torch.mean(elbo)
+        def get_neg_elbo(tasks_dicts):
+            # data tiled to svi_batch_shape is cached in the task dicts
+            data_tuples_tiled = [
+                (task_dict["train_x_tiled"], task_dict["train_y_tiled"])
+                for task_dict in tasks_dicts
+            ]
+
+            # the posterior sample and its log-density are always computed in fp32
+            param_sample = self.posterior.rsample_into(self._noise_buf)
+            log_prob_posterior = self.posterior.log_prob(param_sample)
+            with torch.autocast(
+                device_type=device.type,
+                dtype=torch.bfloat16,
+                enabled=self.elbo_precision == "bf16",
+            ):
+                log_prob_data = self.random_gp.log_prob(param_sample, data_tuples_tiled)
+
+            # shapes are fixed across iterations -> only check them once
+            if __debug__ and not self._elbo_shape_checked:
+                assert (
+                    log_prob_data.ndim == 1
+                    and log_prob_data.shape[0] == self.svi_batch_size
+                )
+                self._elbo_shape_checked = True
+            return _neg_elbo(log_prob_data, log_prob_posterior, self.prior_factor)
 
         self.get_neg_elbo = get_neg_elbo
 
         """ define predictive dist """
 
         def get_pred_dist(x_context, y_context, x_valid, n_post_samples=100):
-            with torch.no_grad():
-                x_context = x_context.view(torch.Size((1,)) + x_context.shape).repeat(
-                    n_post_samples, 1, 1
+            with torch.inference_mode():
+                x_context = x_context.unsqueeze(0).expand(
+                    n_post_samples, *x_context.shape
                 )
-                y_context = y_context.view(torch.Size((1,)) + y_context.shape).repeat(
-                    n_post_samples, 1
-                )
-                x_valid = x_valid.view(torch.Size((1,)) + x_valid.shape).repeat(
-                    n_post_samples, 1, 1
+                y_context = y_context.unsqueeze(0).expand(
+                    n_post_samples, *y_context.shape
                 )
+                x_valid = x_valid.unsqueeze(0).expand(n_post_samples, *x_valid.shape)
 
                 param_sample = self.posterior.sample(sample_shape=(n_post_samples,))
                 gp_fn = self.random_gp.get_forward_fn(param_sample)
@@ -315,16 +357,11 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
             return pred_dist
 
         def get_pred_dist_map(x_context, y_context, x_valid):
-            with torch.no_grad():
-                x_context = x_context.view(torch.Size((1,)) + x_context.shape).repeat(
-                    1, 1, 1
-                )
-                y_context = y_context.view(torch.Size((1,)) + y_context.shape).repeat(
-                    1, 1
-                )
-                x_valid = x_valid.view(torch.Size((1,)) + x_valid.shape).repeat(1, 1, 1)
-                param = self.posterior.mode
-                param = param.view(torch.Size((1,)) + param.shape).repeat(1, 1)
+            with torch.inference_mode():
+                x_context = x_context.unsqueeze(0)
+                y_context = y_context.unsqueeze(0)
+                x_valid = x_valid.unsqueeze(0)
+                param = self.posterior.mode.unsqueeze(0)
 
                 gp_fn = self.random_gp.get_forward_fn(param)
                 gp, likelihood = gp_fn(x_context, y_context, train=False)
@@ -359,6 +396,11 @@ class GPRegressionMetaLearnedVI(RegressionModelMetaLearned):
         )
 
 
+@torch.jit.script
+def _neg_elbo(log_prob_data, log_prob_posterior, prior_factor: float):
+    return -torch.mean(torch.sub(log_prob_data, log_prob_posterior, alpha=prior_factor))
+
+
 if __name__ == "__main__":
     """1) Generate some training data from GP prior"""
     from experiments.data_sim import GPFunctionsDataset
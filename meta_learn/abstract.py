@@ -329,9 +329,13 @@ class RegressionModelMetaLearned:
             assert y_data.shape[1] == 1
             y_data = y_data.flatten()
 
-        # c) convert to tensors
-        x_tensor = torch.from_numpy(x_data).float().to(device)
-        y_tensor = torch.from_numpy(y_data).float().to(device)
+        # c) convert to tensors (via pinned memory & async copy if on GPU)
+        x_tensor = torch.from_numpy(x_data).float()
+        y_tensor = torch.from_numpy(y_data).float()
+        if device.type == "cuda":
+            x_tensor, y_tensor = x_tensor.pin_memory(), y_tensor.pin_memory()
+        x_tensor = x_tensor.to(device, non_blocking=True)
+        y_tensor = y_tensor.to(device, non_blocking=True)
 
         return x_tensor, y_tensor
 
@@ -344,7 +348,7 @@ def _calib_error(pred_dist_vectorized, test_t_tensor):
         cdf_vals = cdf_vals.flatten()
 
     num_points = test_t_tensor.shape[0]
-    conf_levels = torch.linspace(0.05, 0.95, 20)
+    conf_levels = torch.linspace(0.05, 0.95, 20, device=cdf_vals.device)
     emp_freq_per_conf_level = (
         torch.sum(cdf_vals[:, None] <= conf_levels, dim=0).float() / num_points
     )
@@ -1,4 +1,8 @@
+import os
 import torch
 
 # device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 device = torch.device("cpu")
+
+# opt-in consistency checks, enabled with PACOH_VALIDATE=1 (e.g. in CI), skipped with python -O
+validate = __debug__ and os.environ.get("PACOH_VALIDATE", "0") == "1"
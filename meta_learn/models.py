@@ -26,12 +26,12 @@ class AffineTransformedDistribution(TransformedDistribution):
     """
 
     def __init__(self, base_dist, normalization_mean, normalization_std):
-        self.loc_tensor = (
-            torch.tensor(normalization_mean).float().reshape((1,)).to(device)
-        )
-        self.scale_tensor = (
-            torch.tensor(normalization_std).float().reshape((1,)).to(device)
-        )
+        self.loc_tensor = torch.tensor(
+            normalization_mean, dtype=torch.float32, device=device
+        ).reshape((1,))
+        self.scale_tensor = torch.tensor(
+            normalization_std, dtype=torch.float32, device=device
+        ).reshape((1,))
         normalization_transform = AffineTransform(
             loc=self.loc_tensor, scale=self.scale_tensor
         )
@@ -202,6 +202,67 @@ class CatDist(Distribution):
         )
 
 
+class FlatDist(Distribution):
+    """
+    Diagonal Normal over a flat vector, e.g. the concatenation of element-wise Normal distributions
+    which would otherwise be stitched together with CatDist. All operations are single tensor ops.
+
+    Args:
+        loc: (torch.Tensor) 1-dim tensor of means
+        scale: (torch.Tensor) 1-dim tensor of standard deviations
+        log_scale: (torch.Tensor) 1-dim tensor of log standard deviations, alternative to scale
+    """
+
+    arg_constraints = {}
+
+    def __init__(self, loc, scale=None, log_scale=None):
+        assert (scale is None) != (log_scale is None)
+        if log_scale is None:
+            log_scale = torch.log(scale)
+        else:
+            scale = torch.exp(log_scale)
+        assert loc.ndim == 1 and loc.shape == scale.shape
+        self.loc = loc
+        self.scale = scale
+        self.log_scale = log_scale
+        super().__init__(event_shape=loc.shape, validate_args=False)
+
+    @property
+    def mean(self):
+        return self.loc
+
+    @property
+    def stddev(self):
+        return self.scale
+
+    @property
+    def variance(self):
+        return self.scale**2
+
+    def sample(self, sample_shape=torch.Size()):
+        with torch.no_grad():
+            return self.rsample(sample_shape)
+
+    def rsample(self, sample_shape=torch.Size()):
+        eps = torch.randn(self._extended_shape(sample_shape), device=self.loc.device)
+        return self.loc + self.scale * eps
+
+    def log_prob(self, value):
+        return _normal_log_prob(value, self.loc, self.log_scale)
+
+    def entropy(self):
+        return torch.sum(self.log_scale) + 0.5 * self.loc.shape[-1] * (
+            1.0 + math.log(2 * math.pi)
+        )
+
+
+@torch.jit.script
+def _normal_log_prob(value, loc, log_scale):
+    z = (value - loc) * torch.exp(-log_scale)
+    log_probs = -0.5 * z * z - log_scale - 0.5 * math.log(2 * math.pi)
+    return torch.sum(log_probs, dim=-1)
+
+
 """ ----------------------------------------------------"""
 """ ------------------ Neural Network ------------------"""
 """ ----------------------------------------------------"""
@@ -275,6 +336,7 @@ class VectorizedModel:
     def __init__(self, input_dim, output_dim):
         self.input_dim = input_dim
         self.output_dim = output_dim
+        self._param_slices = None
 
     def parameter_shapes(self):
         raise NotImplementedError
@@ -300,17 +362,22 @@ class VectorizedModel:
         return torch.cat(self.parameters(), dim=-1)
 
     def set_parameters_as_vector(self, value):
-        idx = 0
-        for name, shape in self.parameter_shapes().items():
-            idx_next = idx + shape[-1]
-            if value.ndim == 1:
-                self.set_parameter(name, value[idx:idx_next])
-            elif value.ndim == 2:
-                self.set_parameter(name, value[:, idx:idx_next])
-            else:
-                raise AssertionError
-            idx = idx_next
-        assert idx_next == value.shape[-1]
+        if value.ndim not in [1, 2]:
+            raise AssertionError
+        param_slices = self._get_param_slices()
+        for name, idx, idx_next in param_slices:
+            self.set_parameter(name, value[..., idx:idx_next])
+        assert param_slices[-1][-1] == value.shape[-1]
+
+    def _get_param_slices(self):
+        # (name, idx_start, idx_end) of the parameters in the flat parameter vector
+        if self._param_slices is None:
+            self._param_slices = []
+            idx = 0
+            for name, shape in self.parameter_shapes().items():
+                self._param_slices.append((name, idx, idx + shape[-1]))
+                idx += shape[-1]
+        return self._param_slices
 
 
 class LinearVectorized(VectorizedModel):
@@ -334,14 +401,17 @@ class LinearVectorized(VectorizedModel):
             nn.init.uniform_(self.bias, -bound, bound)
 
     def forward(self, x):
-        if self.weight.ndim == 2 or self.weight.ndim == 3:
-            model_batch_size = self.weight.shape[0]
+        return self.forward_with_params(x, self.weight, self.bias)
+
+    def forward_with_params(self, x, weight, bias):
+        if weight.ndim == 2 or weight.ndim == 3:
+            model_batch_size = weight.shape[0]
             # batched computation
-            if self.weight.ndim == 3:
-                assert self.weight.shape[-2] == 1 and self.bias.shape[-2] == 1
+            if weight.ndim == 3:
+                assert weight.shape[-2] == 1 and bias.shape[-2] == 1
 
-            W = self.weight.view(model_batch_size, self.output_dim, self.input_dim)
-            b = self.bias.view(model_batch_size, self.output_dim)
+            W = weight.view(model_batch_size, self.output_dim, self.input_dim)
+            b = bias.view(model_batch_size, self.output_dim)
 
             if x.ndim == 2:
                 # introduce new dimension 0
@@ -352,10 +422,8 @@ class LinearVectorized(VectorizedModel):
                 assert x.ndim == 3 and x.shape[0] == model_batch_size
             # out dimensions correspond to [nn_batch_size, data_batch_size, out_features)
             return torch.bmm(x, W.permute(0, 2, 1)) + b[:, None, :]
-        elif self.weight.ndim == 1:
-            return F.linear(
-                x, self.weight.view(self.output_dim, self.input_dim), self.bias
-            )
+        elif weight.ndim == 1:
+            return F.linear(x, weight.view(self.output_dim, self.input_dim), bias)
         else:
             raise NotImplementedError
 
@@ -394,6 +462,27 @@ class NeuralNetworkVectorized(VectorizedModel):
         output = getattr(self, "out")(output)
         return output
 
+    def forward_with_params(self, x, params, prefix=""):
+        """
+        Forward pass with externally supplied parameters instead of the ones stored in the layers
+
+        Args:
+            x: (torch.Tensor) input data
+            params: (dict) parameter tensors, keyed like named_parameters() (+ prefix)
+            prefix: (str) prefix of the parameter names in params
+        """
+        output = x
+        for i in range(1, self.n_layers + 1):
+            layer_name = prefix + "fc_%i" % i
+            output = getattr(self, "fc_%i" % i).forward_with_params(
+                output, params[layer_name + ".weight"], params[layer_name + ".bias"]
+            )
+            output = self.nonlinearlity(output)
+        output = getattr(self, "out").forward_with_params(
+            output, params[prefix + "out.weight"], params[prefix + "out.bias"]
+        )
+        return output
+
     def parameter_shapes(self):
         param_dict = OrderedDict()
 
@@ -517,6 +606,7 @@ class HomoskedasticNoiseLight(
         self.noise_var = noise_var
         self._modules = {}
         self._parameters = {}
+        self.training = True
 
     @property
     def noise(self):
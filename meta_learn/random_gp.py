@@ -1,9 +1,9 @@
-import copy
+import functools
 import gpytorch
 import torch
 import math
 import torch.nn.functional as F
-from pyro.distributions import Normal, LogNormal, Independent
+from torch.distributions import Normal, Independent
 from collections import OrderedDict
 
 from meta_learn.models import (
@@ -13,9 +13,10 @@ from meta_learn.models import (
     GaussianLikelihoodLight,
     VectorizedModel,
     CatDist,
+    FlatDist,
     NeuralNetworkVectorized,
 )
-from meta_learn.config import device
+from meta_learn.config import device, validate
 
 
 def _filter(dict, str):
@@ -40,6 +41,7 @@ class VectorizedGP(VectorizedModel):
         super().__init__(input_dim, 1)
 
         self._params = OrderedDict()
+        self._parameter_shapes = None
         self.mean_module_str = mean_module_str
         self.covar_module_str = covar_module_str
 
@@ -54,7 +56,9 @@ class VectorizedGP(VectorizedModel):
                 ),
             )
         elif mean_module_str == "constant":
-            self.constant_mean = self._param("constant_mean", torch.zeros(1, 1))
+            self.constant_mean = self._param(
+                "constant_mean", torch.zeros(1, 1, device=device)
+            )
         else:
             raise NotImplementedError
 
@@ -69,38 +73,67 @@ class VectorizedGP(VectorizedModel):
                 ),
             )
             self.lengthscale_raw = self._param(
-                "lengthscale_raw", torch.zeros(1, feature_dim)
+                "lengthscale_raw", torch.zeros(1, feature_dim, device=device)
             )
         elif covar_module_str == "SE":
             self.lengthscale_raw = self._param(
-                "lengthscale_raw", torch.zeros(1, input_dim)
+                "lengthscale_raw", torch.zeros(1, input_dim, device=device)
             )
         else:
             raise NotImplementedError
 
-        self.noise_raw = self._param("noise_raw", torch.zeros(1, 1))
+        self.noise_raw = self._param("noise_raw", torch.zeros(1, 1, device=device))
 
     def forward(self, x_data, y_data, train=True, prior=False):
-        assert x_data.ndim == 3
+        return self.forward_with_params(
+            self._params, x_data, y_data, train=train, prior=prior
+        )
 
+    def build_gp_modules(self, params):
+        """
+        Builds the (data independent) mean, kernel and likelihood modules for the given parameters
+
+        Returns: (mean_module, learned_mean, covar_module, learned_kernel, likelihood)
+        """
         if self.mean_module_str == "NN":
-            learned_mean = self.mean_nn
+            learned_mean = functools.partial(
+                self.mean_nn.forward_with_params, params=params, prefix="mean_nn."
+            )
             mean_module = None
         else:
             learned_mean = None
-            mean_module = ConstantMeanLight(self.constant_mean)
+            mean_module = ConstantMeanLight(params["constant_mean"])
 
         if self.covar_module_str == "NN":
-            learned_kernel = self.kernel_nn
+            learned_kernel = functools.partial(
+                self.kernel_nn.forward_with_params, params=params, prefix="kernel_nn."
+            )
         else:
             learned_kernel = None
 
-        lengthscale = F.softplus(self.lengthscale_raw)
+        lengthscale = F.softplus(params["lengthscale_raw"])
         lengthscale = lengthscale.view(lengthscale.shape[0], 1, lengthscale.shape[1])
         covar_module = SEKernelLight(lengthscale)
 
-        noise = F.softplus(self.noise_raw)
+        noise = F.softplus(params["noise_raw"])
         likelihood = GaussianLikelihoodLight(noise)
+        return mean_module, learned_mean, covar_module, learned_kernel, likelihood
+
+    def forward_with_params(
+        self, params, x_data, y_data, train=True, prior=False, gp_modules=None
+    ):
+        """
+        Same as forward but with the parameters (e.g. views into a sampled parameter vector)
+        supplied as dict of tensors, keyed like named_parameters(). Leaves the GP untouched.
+        The mean, kernel and likelihood modules can be passed in as gp_modules (see build_gp_modules)
+        to re-use them across calls with the same parameters.
+        """
+        assert x_data.ndim == 3
+
+        if gp_modules is None:
+            gp_modules = self.build_gp_modules(params)
+        mean_module, learned_mean, covar_module, learned_kernel, likelihood = gp_modules
+
         gp = LearnedGPRegressionModel(
             x_data,
             y_data,
@@ -116,22 +149,45 @@ class VectorizedGP(VectorizedModel):
             return gp, likelihood
         else:
             if train:
+                # the (shared) modules may have been put into eval mode by a previous call
+                gp.train()
                 mll = gpytorch.mlls.ExactMarginalLogLikelihood(likelihood, gp)
                 output = gp(x_data)
-                return likelihood(output), mll(output, y_data)
+                # (lazily evaluated) kernel matrices and their Cholesky always in fp32
+                with torch.autocast(device_type=device.type, enabled=False):
+                    return likelihood(output), mll(output, y_data)
             else:  # --> eval
                 gp.eval()
                 likelihood.eval()
                 return gp, likelihood
 
     def parameter_shapes(self):
-        return OrderedDict(
-            [(name, param.shape) for name, param in self.named_parameters().items()]
-        )
+        if self._parameter_shapes is None:
+            self._parameter_shapes = OrderedDict(
+                [(name, param.shape) for name, param in self.named_parameters().items()]
+            )
+        return self._parameter_shapes
 
     def named_parameters(self):
         return self._params
 
+    def set_parameter(self, name, value):
+        super().set_parameter(name, value)
+        self._params[name] = value
+        self._parameter_shapes = None
+
+    def vector_to_parameters(self, value):
+        """
+        Splits a (batched) parameter vector into a dict of parameter tensors, keyed like named_parameters().
+        The returned tensors are views into value, i.e. no copy is made and gradients flow back to value.
+        """
+        return OrderedDict(
+            [
+                (name, value[..., idx:idx_next])
+                for name, idx, idx_next in self._get_param_slices()
+            ]
+        )
+
     def _param_module(self, name, module):
         assert type(name) == str
         assert hasattr(module, "named_parameters")
@@ -143,9 +199,15 @@ class VectorizedGP(VectorizedModel):
         assert type(name) == str
         assert isinstance(tensor, torch.Tensor)
         assert name not in list(self._params.keys())
-        if not device.type == tensor.device.type:
-            tensor = tensor.to(device)
+        # tensors always carry a device index, so resolve an index-less cuda device first
+        target_device = device
+        if target_device.type == "cuda" and target_device.index is None:
+            target_device = torch.device("cuda", torch.cuda.current_device())
+        if tensor.device != target_device:
+            tensor = tensor.to(target_device, non_blocking=True)
         self._params[name] = tensor
+        self._parameter_shapes = None
+        self._param_slices = None
         return tensor
 
     def __call__(self, *args, **kwargs):
@@ -159,49 +221,109 @@ class _RandomGPBase:
         prior_factor=1.0,
         weight_prior_std=1.0,
         bias_prior_std=3.0,
+        flat_prior=True,
         **kwargs
     ):
         self._params = OrderedDict()
+        self._param_shapes = OrderedDict()
         self._param_dists = OrderedDict()
 
         self.prior_factor = prior_factor
         self.gp = VectorizedGP(size_in, **kwargs)
 
+        param_dists = []
+        nn_prior_stds = []
+        nn_position = None
         for name, shape in self.gp.parameter_shapes().items():
+            self._param_shapes[name] = torch.Size((shape[-1],))
+
+            # scalar scales are broadcast to the shape of loc (which sets the event shape)
             if name == "constant_mean":
-                mean_p_loc = torch.zeros(1).to(device)
-                mean_p_scale = torch.ones(1).to(device)
-                self._param_dist(name, Normal(mean_p_loc, mean_p_scale).to_event(1))
+                mean_p_loc = torch.zeros(1, device=device)
+                param_dists.append((name, Independent(Normal(mean_p_loc, 1.0), 1)))
 
             if name == "lengthscale_raw":
-                lengthscale_p_loc = torch.zeros(shape[-1]).to(device)
-                lengthscale_p_scale = torch.ones(shape[-1]).to(device)
-                self._param_dist(
-                    name, Normal(lengthscale_p_loc, lengthscale_p_scale).to_event(1)
+                lengthscale_p_loc = torch.zeros(shape[-1], device=device)
+                param_dists.append(
+                    (name, Independent(Normal(lengthscale_p_loc, 1.0), 1))
                 )
 
             if name == "noise_raw":
-                noise_p_loc = -1.0 * torch.ones(1).to(device)
-                noise_p_scale = torch.ones(1).to(device)
-                self._param_dist(name, Normal(noise_p_loc, noise_p_scale).to_event(1))
+                noise_p_loc = torch.full((1,), -1.0, device=device)
+                param_dists.append((name, Independent(Normal(noise_p_loc, 1.0), 1)))
 
             if "mean_nn" in name or "kernel_nn" in name:
-                mean = torch.zeros(shape).to(device)
                 if "weight" in name:
-                    std = weight_prior_std * torch.ones(shape).to(device)
+                    std = weight_prior_std
                 elif "bias" in name:
-                    std = bias_prior_std * torch.ones(shape).to(device)
+                    std = bias_prior_std
                 else:
                     raise NotImplementedError
-                self._param_dist(name, Normal(mean, std).to_event(1))
+                if nn_position is None:
+                    nn_position = len(param_dists)
+                nn_prior_stds.append(torch.full((shape[-1],), std, device=device))
+
+        # a single prior over all (contiguous) NN weights and biases
+        if len(nn_prior_stds) > 0:
+            nn_prior_std = torch.cat(nn_prior_stds)
+            param_dists.insert(
+                nn_position,
+                (
+                    "nn_params",
+                    Independent(
+                        Normal(torch.zeros_like(nn_prior_std), nn_prior_std), 1
+                    ),
+                ),
+            )
 
-        # check that parameters in prior and gp modules are aligned
-        for param_name_gp, param_name_prior in zip(
-            self.gp.named_parameters().keys(), self._param_dists.keys()
-        ):
-            assert param_name_gp == param_name_prior
+        # keys of _param_dists are prior components, not GP parameter names
+        for name, dist in param_dists:
+            self._param_dist(name, dist)
+
+        if validate:
+            # check that prior components and gp parameters are aligned (names and offsets)
+            gp_layout = []
+            offset = 0
+            for name, shape in self.gp.parameter_shapes().items():
+                if "mean_nn" in name or "kernel_nn" in name:
+                    name = "nn_params"
+                if len(gp_layout) > 0 and gp_layout[-1][0] == name == "nn_params":
+                    gp_layout[-1][2] = offset + shape[-1]
+                else:
+                    gp_layout.append([name, offset, offset + shape[-1]])
+                offset += shape[-1]
+
+            prior_layout = []
+            offset = 0
+            for name, dist in self._param_dists.items():
+                prior_layout.append([name, offset, offset + dist.event_shape[-1]])
+                offset += dist.event_shape[-1]
+
+            assert (
+                gp_layout == prior_layout
+            ), "prior components %s do not match gp parameters %s" % (
+                prior_layout,
+                gp_layout,
+            )
 
-        self.hyper_prior = CatDist(self._param_dists.values())
+        # all priors are element-wise Normals -> evaluate them jointly on flat loc / scale vectors
+        if flat_prior:
+            self.hyper_prior = FlatDist(
+                torch.cat(
+                    [
+                        dist.base_dist.loc.expand(dist.event_shape)
+                        for dist in self._param_dists.values()
+                    ]
+                ),
+                torch.cat(
+                    [
+                        dist.base_dist.scale.expand(dist.event_shape)
+                        for dist in self._param_dists.values()
+                    ]
+                ),
+            )
+        else:
+            self.hyper_prior = CatDist(self._param_dists.values())
 
     def sample_params_from_prior(self, shape=torch.Size()):
         return self.hyper_prior.sample(shape)
@@ -211,9 +333,21 @@ class _RandomGPBase:
         return self.get_forward_fn(params)
 
     def get_forward_fn(self, params):
-        gp_model = copy.deepcopy(self.gp)
-        gp_model.set_parameters_as_vector(params)
-        return gp_model
+        params_dict = self.gp.vector_to_parameters(params)
+        # mean, kernel and likelihood only depend on the params -> share them across all calls
+        gp_modules = self.gp.build_gp_modules(params_dict)
+
+        def forward_fn(x_data, y_data, train=True, prior=False):
+            return self.gp.forward_with_params(
+                params_dict,
+                x_data,
+                y_data,
+                train=train,
+                prior=prior,
+                gp_modules=gp_modules,
+            )
+
+        return forward_fn
 
     def _param_dist(self, name, dist):
         assert type(name) == str
@@ -233,10 +367,7 @@ class _RandomGPBase:
         raise NotImplementedError
 
     def parameter_shapes(self):
-        param_shapes_dict = OrderedDict()
-        for name, dist in self._param_dists.items():
-            param_shapes_dict[name] = dist.event_shape
-        return param_shapes_dict
+        return self._param_shapes
 
 
 class RandomGP(_RandomGPBase):
@@ -255,13 +386,10 @@ class RandomGPMeta(_RandomGPBase):
     def _log_prob_likelihood(self, params, train_data_tuples):
         fn = self.get_forward_fn(params)
 
+        # dataset sizes are known on the host -> compute the pre-factor as python scalar
         num_datasets = len(train_data_tuples)
-        dataset_sizes = (
-            torch.tensor([train_x.shape[-2] for train_x, _ in train_data_tuples])
-            .float()
-            .to(device)
-        )
-        harmonic_mean_dataset_size = 1.0 / (torch.mean(1.0 / dataset_sizes))
+        dataset_sizes = [train_x.shape[-2] for train_x, _ in train_data_tuples]
+        harmonic_mean_dataset_size = num_datasets / sum(1.0 / n for n in dataset_sizes)
         pre_factor = harmonic_mean_dataset_size / (
             harmonic_mean_dataset_size + num_datasets
         )
@@ -288,6 +416,7 @@ class RandomGPPosterior(torch.nn.Module):
         super().__init__()
 
         assert cov_type in ["diag", "full"]
+        self.cov_type = cov_type
 
         self.param_idx_ranges = OrderedDict()
 
@@ -299,29 +428,42 @@ class RandomGPPosterior(torch.nn.Module):
             idx_start = idx_end
 
         param_shape = torch.Size((idx_start,))
-        self.loc = torch.nn.Parameter(
-            torch.normal(0.0, init_std, size=param_shape, device=device)
+
+        # draw the initial loc (and log-scale) with a single call
+        n_init_draws = 2 if cov_type == "diag" else 1
+        init_draws = torch.normal(
+            0.0, init_std, size=(n_init_draws,) + param_shape, device=device
         )
+        self.loc = torch.nn.Parameter(init_draws[0].clone())
 
         if cov_type == "diag":
-            self.scale = torch.nn.Parameter(
-                torch.normal(math.log(0.1), init_std, size=param_shape, device=device)
-            )
-            self.dist_fn = lambda: Normal(self.loc, self.scale.exp()).to_event(1)
+            self.scale = torch.nn.Parameter(init_draws[1] + math.log(0.1))
         if cov_type == "full":
             self.tril_cov = torch.nn.Parameter(
                 torch.diag(torch.ones(param_shape, device=device).uniform_(0.05, 0.1))
             )
-            self.dist_fn = lambda: torch.distributions.MultivariateNormal(
-                loc=self.loc, scale_tril=torch.tril(self.tril_cov)
-            )
 
     def forward(self):
-        return self.dist_fn()
+        if self.cov_type == "diag":
+            return FlatDist(self.loc, log_scale=self.scale)
+        return torch.distributions.MultivariateNormal(
+            loc=self.loc, scale_tril=torch.tril(self.tril_cov)
+        )
 
     def rsample(self, sample_shape=torch.Size()):
         return self.forward().rsample(sample_shape)
 
+    def rsample_into(self, eps):
+        """
+        Draws a reparameterized sample, re-using the pre-allocated noise buffer eps.
+        eps is filled in-place with standard normal noise, its leading dims are the sample shape.
+        """
+        eps.normal_()
+        if self.cov_type == "diag":
+            return self.loc + self.scale.exp() * eps
+        else:
+            return self.loc + torch.matmul(eps, torch.tril(self.tril_cov).T)
+
     def sample(self, sample_shape=torch.Size()):
         return self.forward().sample(sample_shape)
 
@@ -330,11 +472,11 @@ class RandomGPPosterior(torch.nn.Module):
 
     @property
     def mode(self):
-        return self.mean
+        return self.loc
 
     @property
     def mean(self):
-        return self.forward().mean
+        return self.loc
 
     @property
     def stddev(self):
@@ -345,19 +487,12 @@ class RandomGPPosterior(torch.nn.Module):
 
     @property
     def mean_stddev_dict(self):
-        mean = self.mean
-        stddev = self.stddev
-        with torch.no_grad():
+        with torch.inference_mode():
+            mean = self.mean
+            stddev = self.stddev
             return OrderedDict(
                 [
                     (name, (mean[idx_start:idx_end], stddev[idx_start:idx_end]))
                     for name, (idx_start, idx_end) in self.param_idx_ranges.items()
                 ]
             )
-
-
-def _get_base_dist(dist):
-    if isinstance(dist, Independent):
-        return _get_base_dist(dist.base_dist)
-    else:
-        return dist
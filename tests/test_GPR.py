@@ -3,6 +3,7 @@ import numpy as np
 
 from meta_learn.GPR_mll import GPRegressionLearned
 from meta_learn.GPR_meta_mll import GPRegressionMetaLearned
+from meta_learn.GPR_meta_vi import GPRegressionMetaLearnedVI
 from gpytorch.kernels import CosineKernel
 import torch
 
@@ -418,6 +419,97 @@ class TestGPR_mll_meta(unittest.TestCase):
         self.assertGreater(test_ll_meta, test_ll_normal)
 
 
+class TestGPR_meta_vi(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(22)
+        np.random.seed(23)
+
+        self.train_data_tuples = [sample_data_nonstationary(5) for _ in range(3)]
+        x, t = sample_data_nonstationary(5 + 20)
+        self.test_data_tuple = (x[:5], t[:5], x[5:], t[5:])
+
+    def test_serializable(self):
+        import itertools
+
+        for mean_module, covar_module in itertools.product(
+            ["constant", "NN"], ["SE", "NN"]
+        ):
+            gpr_model = GPRegressionMetaLearnedVI(
+                self.train_data_tuples,
+                num_iter_fit=5,
+                mean_module=mean_module,
+                covar_module=covar_module,
+                random_seed=22,
+            )
+            gpr_model.meta_fit(verbose=False)
+            torch.manual_seed(30)
+            pred_1 = gpr_model.predict(*self.test_data_tuple[:3])
+
+            gpr_model2 = GPRegressionMetaLearnedVI(
+                self.train_data_tuples,
+                num_iter_fit=5,
+                mean_module=mean_module,
+                covar_module=covar_module,
+                random_seed=25,
+            )
+            gpr_model2.meta_fit(verbose=False)
+            torch.manual_seed(30)
+            pred_2 = gpr_model2.predict(*self.test_data_tuple[:3])
+
+            file = "/tmp/test_torch_serialization.pkl"
+            torch.save(gpr_model.state_dict(), file)
+            gpr_model2.load_state_dict(torch.load(file))
+            torch.manual_seed(30)
+            pred_3 = gpr_model2.predict(*self.test_data_tuple[:3])
+            assert not np.array_equal(pred_1, pred_2)
+            assert np.array_equal(pred_1, pred_3)
+
+            torch.manual_seed(25)
+            gpr_model.meta_fit(verbose=False)
+            torch.manual_seed(25)
+            gpr_model2.meta_fit(verbose=False)
+            torch.manual_seed(30)
+            pred_1 = gpr_model.predict(*self.test_data_tuple[:3])
+            torch.manual_seed(30)
+            pred_2 = gpr_model2.predict(*self.test_data_tuple[:3])
+            assert np.array_equal(pred_1, pred_2)
+
+    def test_bf16_posterior_terms(self):
+        # only the GP forward runs under bf16 autocast -> posterior sample and log-prob match fp32
+        posterior_terms = {}
+        for elbo_precision in ["fp32", "bf16"]:
+            gpr_model = GPRegressionMetaLearnedVI(
+                self.train_data_tuples,
+                mean_module="NN",
+                covar_module="NN",
+                cov_type="full",
+                elbo_precision=elbo_precision,
+                random_seed=22,
+            )
+            posterior = gpr_model.posterior
+            rsample_into, log_prob = posterior.rsample_into, posterior.log_prob
+            recorded = {}
+
+            def _rsample_into(eps):
+                recorded["sample"] = rsample_into(eps)
+                return recorded["sample"]
+
+            def _log_prob(value):
+                recorded["log_prob"] = log_prob(value)
+                return recorded["log_prob"]
+
+            posterior.rsample_into, posterior.log_prob = _rsample_into, _log_prob
+            torch.manual_seed(30)
+            gpr_model.meta_fit(verbose=False, n_iter=1)
+            posterior_terms[elbo_precision] = recorded
+
+        for term in ["sample", "log_prob"]:
+            assert posterior_terms["bf16"][term].dtype == torch.float32
+            assert torch.allclose(
+                posterior_terms["fp32"][term], posterior_terms["bf16"][term]
+            )
+
+
 """ --- helper functions for data generation ---"""
 
 
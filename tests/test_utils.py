@@ -1,13 +1,25 @@
 import unittest
+import copy
+import itertools
+from unittest import mock
 from meta_learn.models import (
     NeuralNetworkVectorized,
     NeuralNetwork,
     LinearVectorized,
     CatDist,
+    FlatDist,
     EqualWeightedMixtureDist,
+    ConstantMeanLight,
+    SEKernelLight,
+    GaussianLikelihoodLight,
+    LearnedGPRegressionModel,
 )
+from meta_learn.random_gp import RandomGPPosterior, RandomGPMeta
 from meta_learn.util import find_root_by_bounding
+from collections import OrderedDict
 import torch
+import torch.nn.functional as F
+import gpytorch
 import pyro
 import numpy as np
 
@@ -260,6 +272,231 @@ class TestCatDist(unittest.TestCase):
         assert np.array_equal(logp1, logp2)
 
 
+class TestFlatDist(unittest.TestCase):
+    def test_sampling(self):
+        torch.manual_seed(22)
+        loc = torch.cat([torch.ones(7), -1 * torch.ones(3)])
+        flatdist = FlatDist(loc, 0.01 * torch.ones(10))
+
+        sample = flatdist.rsample((100,))
+        assert sample.shape == (100, 7 + 3)
+        assert flatdist.sample().shape == (10,)
+
+        sample1_mean = sample[:, :7].mean().item()
+        sample2_mean = sample[:, 7:].mean().item()
+        assert np.abs(sample1_mean - 1) < 0.2
+        assert np.abs(sample2_mean + 1) < 0.2
+
+    def test_pdf(self):
+        torch.manual_seed(22)
+        dist1 = pyro.distributions.Normal(torch.ones(7), 0.01).to_event(1)
+        dist2 = pyro.distributions.Normal(-1 * torch.ones(3), 2.0).to_event(1)
+        catdist = CatDist([dist1, dist2])
+        flatdist = FlatDist(
+            torch.cat([torch.ones(7), -1 * torch.ones(3)]),
+            torch.cat([0.01 * torch.ones(7), 2.0 * torch.ones(3)]),
+        )
+
+        x = torch.normal(0.0, 1.0, size=(150, 10))
+        assert torch.allclose(catdist.log_prob(x), flatdist.log_prob(x), rtol=1e-5)
+        assert torch.allclose(
+            catdist.log_prob(x[0]), flatdist.log_prob(x[0]), rtol=1e-5
+        )
+
+
+class TestRandomGPForwardFn(unittest.TestCase):
+    """forward_fn with parameter views must match a GP assembled from the light modules"""
+
+    @staticmethod
+    def _reference_forward_fn(random_gp, params):
+        # split the parameters by hand and set the NNs layer-wise, i.e. without forward_with_params
+        param_dict = OrderedDict()
+        idx = 0
+        for name, shape in random_gp.parameter_shapes().items():
+            param_dict[name] = params[..., idx : idx + shape[-1]]
+            idx += shape[-1]
+
+        def nn_with_params(nn, prefix):
+            nn = copy.deepcopy(nn)
+            nn.set_parameters_as_vector(
+                torch.cat(
+                    [val for key, val in param_dict.items() if key.startswith(prefix)],
+                    dim=-1,
+                )
+            )
+            return nn
+
+        def forward_fn(x_data, y_data, train=True):
+            if random_gp.gp.mean_module_str == "NN":
+                learned_mean = nn_with_params(random_gp.gp.mean_nn, "mean_nn.")
+                mean_module = None
+            else:
+                learned_mean = None
+                mean_module = ConstantMeanLight(param_dict["constant_mean"])
+
+            if random_gp.gp.covar_module_str == "NN":
+                learned_kernel = nn_with_params(random_gp.gp.kernel_nn, "kernel_nn.")
+            else:
+                learned_kernel = None
+
+            lengthscale = F.softplus(param_dict["lengthscale_raw"])
+            lengthscale = lengthscale.view(
+                lengthscale.shape[0], 1, lengthscale.shape[1]
+            )
+            covar_module = SEKernelLight(lengthscale)
+            likelihood = GaussianLikelihoodLight(F.softplus(param_dict["noise_raw"]))
+
+            gp = LearnedGPRegressionModel(
+                x_data,
+                y_data,
+                likelihood,
+                mean_module=mean_module,
+                covar_module=covar_module,
+                learned_mean=learned_mean,
+                learned_kernel=learned_kernel,
+            )
+            if train:
+                mll = gpytorch.mlls.ExactMarginalLogLikelihood(likelihood, gp)
+                output = gp(x_data)
+                return likelihood(output), mll(output, y_data)
+            gp.eval()
+            likelihood.eval()
+            return gp, likelihood
+
+        return forward_fn
+
+    def test_nn_forward_with_params(self):
+        torch.manual_seed(22)
+        nn = NeuralNetworkVectorized(2, 3, layer_sizes=(8, 8))
+        nn_copy = copy.deepcopy(nn)
+        for shape in [(), (4,)]:
+            params = torch.normal(
+                0.0, 1.0, size=shape + (nn_copy.parameters_as_vector().shape[-1],)
+            )
+            x = torch.normal(0.0, 1.0, size=shape + (5, 2))
+            nn_copy.set_parameters_as_vector(params)
+            param_dict = dict(
+                (name, params[..., idx:idx_next])
+                for name, idx, idx_next in nn._get_param_slices()
+            )
+            assert torch.allclose(
+                nn.forward_with_params(x, param_dict), nn_copy(x), atol=1e-6
+            )
+
+    def test_prior_aligned_with_gp_params(self):
+        for mean_module, covar_module in itertools.product(
+            ["constant", "NN"], ["SE", "NN"]
+        ):
+            with mock.patch("meta_learn.random_gp.validate", True):
+                random_gp = RandomGPMeta(
+                    size_in=2,
+                    mean_module_str=mean_module,
+                    covar_module_str=covar_module,
+                    mean_nn_layers=(8, 8),
+                    kernel_nn_layers=(8, 8),
+                )
+            assert random_gp.hyper_prior.event_shape[-1] == sum(
+                shape[-1] for shape in random_gp.gp.parameter_shapes().values()
+            )
+
+    def test_log_prob_and_predictions(self):
+        for mean_module, covar_module in itertools.product(
+            ["constant", "NN"], ["SE", "NN"]
+        ):
+            torch.manual_seed(22)
+            random_gp = RandomGPMeta(
+                size_in=2,
+                mean_module_str=mean_module,
+                covar_module_str=covar_module,
+                mean_nn_layers=(8, 8),
+                kernel_nn_layers=(8, 8),
+            )
+            random_gp_catdist = RandomGPMeta(
+                size_in=2,
+                mean_module_str=mean_module,
+                covar_module_str=covar_module,
+                mean_nn_layers=(8, 8),
+                kernel_nn_layers=(8, 8),
+                flat_prior=False,
+            )
+            random_gp_catdist.get_forward_fn = (
+                lambda params: self._reference_forward_fn(random_gp, params)
+            )
+
+            for n_samples in [1, 4]:
+                params = random_gp.sample_params_from_prior((n_samples,))
+                params.requires_grad_()
+                data_tuples = [
+                    (
+                        torch.normal(0.0, 1.0, size=(1, n, 2)).expand(n_samples, n, 2),
+                        torch.normal(0.0, 1.0, size=(1, n)).expand(n_samples, n),
+                    )
+                    for n in [5, 8]
+                ]
+
+                # log-prob and gradients
+                log_prob1 = random_gp.log_prob(params, data_tuples)
+                log_prob2 = random_gp_catdist.log_prob(params, data_tuples)
+                (grad1,) = torch.autograd.grad(log_prob1.sum(), params)
+                (grad2,) = torch.autograd.grad(log_prob2.sum(), params)
+                assert log_prob1.shape == (n_samples,)
+                assert torch.allclose(log_prob1, log_prob2, rtol=1e-5, atol=1e-5)
+                assert torch.allclose(grad1, grad2, rtol=1e-5, atol=1e-5)
+
+                # eval-mode predictions
+                x_context, y_context = data_tuples[0]
+                x_test = data_tuples[1][0]
+                preds = []
+                for forward_fn in [
+                    random_gp.get_forward_fn(params),
+                    self._reference_forward_fn(random_gp, params),
+                ]:
+                    with torch.no_grad():
+                        gp, likelihood = forward_fn(x_context, y_context, train=False)
+                        preds.append(likelihood(gp(x_test)))
+                assert torch.allclose(preds[0].mean, preds[1].mean, atol=1e-5)
+                assert torch.allclose(preds[0].stddev, preds[1].stddev, atol=1e-5)
+
+
+class TestRandomGPPosterior(unittest.TestCase):
+    def setUp(self):
+        self.param_shapes = OrderedDict(
+            [("a", torch.Size((3,))), ("b", torch.Size((20,)))]
+        )
+
+    def test_rsample_into_diag(self):
+        torch.manual_seed(22)
+        posterior = RandomGPPosterior(self.param_shapes, cov_type="diag")
+        dist = torch.distributions.Independent(
+            torch.distributions.Normal(posterior.loc, posterior.scale.exp()), 1
+        )
+
+        torch.manual_seed(5)
+        sample1 = posterior.rsample_into(torch.empty(7, 23))
+        torch.manual_seed(5)
+        sample2 = dist.rsample((7,))
+        assert sample1.shape == (7, 23)
+        assert torch.allclose(sample1, sample2, atol=1e-6)
+
+    def test_rsample_into_full(self):
+        torch.manual_seed(22)
+        posterior = RandomGPPosterior(self.param_shapes, cov_type="full")
+        with torch.no_grad():
+            posterior.tril_cov.add_(
+                torch.tril(0.1 * torch.randn_like(posterior.tril_cov), diagonal=-1)
+            )
+        dist = torch.distributions.MultivariateNormal(
+            posterior.loc, scale_tril=torch.tril(posterior.tril_cov)
+        )
+
+        torch.manual_seed(5)
+        sample1 = posterior.rsample_into(torch.empty(7, 23))
+        torch.manual_seed(5)
+        sample2 = dist.rsample((7,))
+        assert sample1.shape == (7, 23)
+        assert torch.allclose(sample1, sample2, atol=1e-6)
+
+
 class TestEqualWeightedMixture(unittest.TestCase):
     def setUp(self):
         from pyro.distributions import Normal